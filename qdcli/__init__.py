@@ -7,6 +7,25 @@ import sys
 
 import yaml
 
+try:
+    from yaml import CSafeDumper as YamlDumper, CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeDumper as YamlDumper, SafeLoader as YamlLoader
+
+try:
+    import orjson
+
+    def _json_dumps(obj):
+        return orjson.dumps(obj)
+
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+
+    _json_loads = json.loads
+
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
 from functools import partial
 
@@ -41,6 +60,28 @@ class QueryDuckCLI(object):
         )
         self.repo = self.qd.get_repo()
         self.bindings = self.qd.get_bindings()
+        self.volume_roots = {
+            reference: pathlib.Path(options["path"])
+            for reference, options in self.config.get("volumes", {}).items()
+        }
+        self._include_rules = None
+        self.commands = {
+            "query": lambda args: self.action_query(
+                target=args.target, output=args.output, param_strs=args.options),
+            "show": lambda args: self.action_show_resources(args.options[0]),
+            "export": lambda args: self.action_export(args.options[0]),
+            "import": lambda args: self.action_import(args.options[0]),
+            "edit": lambda args: self.action_edit_resources(args.options[0]),
+            "analyze_files": lambda args: self.action_analyze_files(
+                args.options, output=args.output),
+            "set_file": lambda args: self.action_set_file(args.options),
+            "import_schema": lambda args: self.action_import_schema(args.options[0]),
+            "update_volume": lambda args: self.action_update_volume(args.options[0]),
+            "process_blobs": lambda args: self.action_process_blobs(),
+            "list_blobs": lambda args: self.action_list_blobs(),
+            "process_volume": lambda args: self.action_process_volume(args.options[0]),
+            "test": lambda args: self.action_test(),
+        }
 
     def _create_parser(self):
         parser = argparse.ArgumentParser()
@@ -53,40 +94,16 @@ class QueryDuckCLI(object):
     def run(self, *params):
         """Perform the action requested by the user"""
         args = self.parser.parse_args(params)
-        if args.command == "query":
-            self.action_query(target=args.target, output=args.output, param_strs=args.options)
-        elif args.command == "show":
-            self.action_show_resources(args.options[0])
-        elif args.command == "export":
-            self.action_export(args.options[0])
-        elif args.command == "import":
-            self.action_import(args.options[0])
-        elif args.command == "edit":
-            self.action_edit_resources(args.options[0])
-        elif args.command == "analyze_files":
-            self.action_analyze_files(args.options, output=args.output)
-        elif args.command == "set_file":
-            self.action_set_file(args.options)
-        elif args.command == "import_schema":
-            self.action_import_schema(args.options[0])
-        elif args.command == "update_volume":
-            self.action_update_volume(args.options[0])
-        elif args.command == "process_blobs":
-            self.action_process_blobs()
-        elif args.command == "list_blobs":
-            self.action_list_blobs()
-        elif args.command == "process_volume":
-            self.action_process_volume(args.options[0])
-        elif args.command == "test":
-            self.action_test()
+        if args.command in self.commands:
+            self.commands[args.command](args)
         else:
             print("Unknown command:", args.command)
 
     def _process_query_string(self, query_string):
         if query_string == "-":
-            q = yaml.load(sys.stdin, Loader=yaml.SafeLoader)
+            q = yaml.load(sys.stdin.buffer.read(), Loader=YamlLoader)
         else:
-            q = yaml.load(query_string, Loader=yaml.SafeLoader)
+            q = yaml.load(query_string, Loader=YamlLoader)
         parser = partial(parse_identifier, self.repo, self.bindings)
         query = transform_doc(q, parser)
         return query
@@ -94,17 +111,17 @@ class QueryDuckCLI(object):
     def _results_to_yaml(self, results, coll):
         doctf = DocProcessor(coll, self.bindings)
         docs = [doctf.value_to_doc(s) for s in results]
-        print(yaml.dump_all(docs, sort_keys=False), end="")
+        yaml.dump_all(docs, sys.stdout, sort_keys=False, Dumper=YamlDumper)
 
     def _show_results(self, results, coll):
-        b = self.qd.get_bindings()
+        b = self.bindings
         for v in results:
             print(coll.object_for(v, b.label))
             blob = coll.object_for(v, b.fileContent)
             print(coll.get_files(blob))
 
     def _show_files(self, results, coll):
-        b = self.qd.get_bindings()
+        out = bytearray()
         for v in results:
             files = coll.get_files(v)
             if len(files):
@@ -114,19 +131,20 @@ class QueryDuckCLI(object):
             for f in coll.get_files(blob):
                 filepath = self._get_file_path(f)
                 if filepath:
-                    sys.stdout.buffer.write(bytes(filepath) + b"\n")
+                    out += bytes(filepath)
+                    out += b"\n"
                     break
+        sys.stdout.buffer.write(out)
 
     def _get_file_path(self, file_):
-        for volume_reference, volume_options in self.config["volumes"].items():
-            if volume_reference == file_.volume:
-                p = pathlib.Path(volume_options["path"])
-                return p / pathlib.Path(os.fsdecode(file_.path))
-        return None
+        root = self.volume_roots.get(file_.volume)
+        if root is None:
+            return None
+        return root / pathlib.Path(os.fsdecode(file_.path))
 
     def action_query(self, target, output, param_strs):
-        repo = self.qd.get_repo()
-        bindings = self.qd.get_bindings()
+        repo = self.repo
+        bindings = self.bindings
         def deserializer(string):
             if string.startswith("@") and string[1:] in bindings:
                 return bindings[string[1:]]
@@ -142,8 +160,8 @@ class QueryDuckCLI(object):
             self._show_files(results, coll)
 
     def action_export(self, filename):
-        repo = self.qd.get_repo()
-        with open(filename, "w") as f:
+        repo = self.repo
+        with open(filename, "wb", buffering=1 << 20) as f:
             after = None
             while True:
                 statements = repo.export_statements(after=after)
@@ -151,15 +169,14 @@ class QueryDuckCLI(object):
                     after = statements[-1][0]
                 else:
                     break
-                for q in statements:
-                    f.write(json.dumps(q) + "\n")
+                f.writelines(_json_dumps(q) + b"\n" for q in statements)
 
     def action_import(self, filename):
-        repo = self.qd.get_repo()
-        with open(filename, "r") as f:
+        repo = self.repo
+        with open(filename, "rb", buffering=1 << 20) as f:
             quads = []
             for line in f:
-                quads.append(json.loads(line))
+                quads.append(_json_loads(line))
                 if len(quads) >= 10000:
                     repo.import_statements(quads)
                     quads = []
@@ -206,6 +223,19 @@ class QueryDuckCLI(object):
         vfa = VolumeFileAnalyzer(self.config["volumes"])
         context = self.qd.get_context()
 
+        parsed_options = []
+        for opt in options:
+            pred_str, obj_str = opt.split("=")
+            chained = pred_str.startswith("+")
+            if chained:
+                pred_str = pred_str[1:]
+            pred = context.parse_identifier(pred_str)
+            if obj_str == "now":
+                obj = now
+            else:
+                obj = context.parse_identifier(obj_str)
+            parsed_options.append((chained, pred, obj))
+
         for filepath in files:
 
             f = vfa.analyze(pathlib.Path(filepath))
@@ -225,21 +255,13 @@ class QueryDuckCLI(object):
                 return
 
             main = results[0]
-            for opt in options:
-                pred_str, obj_str = opt.split("=")
-                if pred_str.startswith("+"):
+            for chained, pred, obj in parsed_options:
+                if chained:
                     subj = last
-                    pred_str = pred_str[1:]
                 else:
                     subj = main
                     last = None
 
-                pred = context.parse_identifier(pred_str)
-
-                if obj_str == "now":
-                    obj = now
-                else:
-                    obj = context.parse_identifier(obj_str)
                 st = context.transaction.add(subj, pred, obj)
                 if last is None:
                     last = st
@@ -276,41 +298,53 @@ class QueryDuckCLI(object):
 
         return analyzer.process_blob(blob, path, context)
 
+    def _fetch_blob_page(self, after):
+        context = self.qd.get_context()
+        b = context.bindings
+        m = Main(Blob)
+        resource = m.subject_for(b.fileContent)
+        allpred = resource.object_for()
+        q = QDQuery(Blob).add(
+            allpred.fetch(),
+        )
+        if after:
+            q = q.add(AfterTuple((after,)))
+
+        results = context.execute(q)
+        return context, q, results
+
     def action_process_blobs(self):
         if not FileAnalyzer.check_requirements():
             print("Missing requirements")
             sys.exit(1)
-        repo = self.qd.get_repo()
-        b = self.qd.get_bindings()
-
-        after = None
-        while True:
-            context = self.qd.get_context()
-            m = Main(Blob)
-            resource = m.subject_for(b.fileContent)
-            allpred = resource.object_for()
-            q = QDQuery(Blob).add(
-                allpred.fetch(),
-            )
-            if after:
-                q = q.add(AfterTuple((after,)))
-
-            results = context.execute(q)
-            fa = FileAnalyzer(context.bindings)
-            for blob in results:
-                self._process_blob(blob, context, fa)
-
-            context.transaction.show()
-            context.repo.submit(context.transaction)
-            if len(results) >= q.limit:
-                after = results[-1]
-            else:
-                break
-            print("---------------- NEXT ------------------")
+
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            page = prefetcher.submit(self._fetch_blob_page, None)
+            while True:
+                context, q, results = page.result()
+                if len(results) >= q.limit:
+                    page = prefetcher.submit(self._fetch_blob_page, results[-1])
+                else:
+                    page = None
+
+                fa = FileAnalyzer(context.bindings)
+                with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                    futures = [
+                        executor.submit(self._process_blob, blob, context, fa)
+                        for blob in results
+                    ]
+                    for future in futures:
+                        future.result()
+
+                context.transaction.show()
+                context.repo.submit(context.transaction)
+                if page is None:
+                    break
+                print("---------------- NEXT ------------------")
 
     def action_process_volume(self, volume_reference):
-        repo = self.qd.get_repo()
-        bindings = self.qd.get_bindings()
+        repo = self.repo
+        bindings = self.bindings
 
         root = pathlib.Path(self.config["volumes"][volume_reference]["path"])
         afi = ApiFileIterator(self.qd.conn, volume_reference, without_statements=True)
@@ -338,12 +372,14 @@ class QueryDuckCLI(object):
             for k, v in info.items():
                 print(
                     bindings.reverse(k),
-                    [bindings.reverse(vv) for vv in (v if type(v) == list else [v])],
+                    [bindings.reverse(vv) for vv in (v if isinstance(v, list) else [v])],
                 )
             for k, v in info.items():
-                values = v if type(v) == list else [v]
-                for val in values:
-                    transaction.ensure(resource, k, val)
+                if isinstance(v, list):
+                    for val in v:
+                        transaction.ensure(resource, k, val)
+                else:
+                    transaction.ensure(resource, k, v)
 
             if idx > 1000:
                 break
@@ -354,65 +390,65 @@ class QueryDuckCLI(object):
         return
         repo.submit(transaction)
 
-    def _check_include_blob(self, blob, context):
-        b, c = context.get_bc()
-        include = False
-        rules = self.config.get("qdcli", {}).get("include_rules", [])
-        resources = c.subjects_for(blob, b.fileContent)
-        for resource in resources:
-            for rule in rules:
+    def _compile_include_rules(self):
+        if self._include_rules is None:
+            b = self.bindings
+            self._include_rules = []
+            for rule in self.config.get("qdcli", {}).get("include_rules", []):
                 set_include = True
-                skip = False
+                conditions = []
                 for k, v in rule.items():
                     if k == "include":
                         set_include = v
                     else:
-                        values = c.objects_for(resource, b[k])
-                        if not b[v] in values:
-                            skip = True
-                            break
-                if skip:
-                    continue
+                        conditions.append((b[k], b[v]))
+                self._include_rules.append((set_include, conditions))
+        return self._include_rules
 
-                include = set_include
+    def _check_include_blob(self, blob, context):
+        b, c = context.get_bc()
+        include = False
+        rules = self._compile_include_rules()
+        resources = c.subjects_for(blob, b.fileContent)
+        for resource in resources:
+            for set_include, conditions in rules:
+                for pred, expected in conditions:
+                    if expected not in c.objects_for(resource, pred):
+                        break
+                else:
+                    include = set_include
             if include:
                 return include
         return include
 
     def action_list_blobs(self):
 
-        after = None
-        while True:
-            context = self.qd.get_context()
-            b, c = context.get_bc()
-            m = Main(Blob)
-            resource = m.subject_for(b.fileContent)
-            allpred = resource.object_for()
-            q = QDQuery(Blob).add(
-                allpred.fetch(),
-            )
-            if after:
-                q = q.add(AfterTuple((after,)))
-
-            results = context.execute(q)
-            for blob in results:
-                if not self._check_include_blob(blob, context):
-                    continue
-                scores = []
-                for r in c.subjects_for(blob, b.fileContent):
-                    for s in c.objects_for(r, b.score):
-                        print("SCORE", r, s)
-                        scores.append(s)
-                for f in c.get_files(blob):
-                    path = self._get_file_path(f)
-                    if path and os.path.exists(path):
-                        print(safe_string(str(path)))
-                        break
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            page = prefetcher.submit(self._fetch_blob_page, None)
+            while True:
+                context, q, results = page.result()
+                if len(results) >= q.limit:
+                    page = prefetcher.submit(self._fetch_blob_page, results[-1])
+                else:
+                    page = None
+
+                b, c = context.get_bc()
+                for blob in results:
+                    if not self._check_include_blob(blob, context):
+                        continue
+                    scores = []
+                    for r in c.subjects_for(blob, b.fileContent):
+                        for s in c.objects_for(r, b.score):
+                            print("SCORE", r, s)
+                            scores.append(s)
+                    for f in c.get_files(blob):
+                        path = self._get_file_path(f)
+                        if path and os.path.exists(path):
+                            print(safe_string(str(path)))
+                            break
 
-            if len(results) >= q.limit:
-                after = results[-1]
-            else:
-                break
+                if page is None:
+                    break
 
     def identifier_to_docs(self, identifier):
         docs = []
@@ -434,10 +470,9 @@ class QueryDuckCLI(object):
         return docs
 
     def edit_docs(self, docs):
-        text = yaml.dump_all(docs, sort_keys=False)
+        text = yaml.dump_all(docs, sort_keys=False, Dumper=YamlDumper)
         text = call_text_editor(text)
-        docs = list(yaml.load_all(text, Loader=yaml.SafeLoader))
-        return docs
+        return yaml.load_all(text, Loader=YamlLoader)
 
     def docs_to_transaction(self, docs):
         transaction = Transaction()
@@ -461,9 +496,7 @@ class QueryDuckCLI(object):
                         transaction.ensure(resource, b.label, label)
                 else:
                     prd = b[k]
-                    if type(v) != list:
-                        v = [v]
-                    for ser_obj in v:
+                    for ser_obj in v if isinstance(v, list) else (v,):
                         if ser_obj in b:
                             obj = b[ser_obj]
                         else:
@@ -481,7 +514,7 @@ class QueryDuckCLI(object):
     def action_show_resources(self, identifier):
         docs = []
         docs += self.identifier_to_docs(identifier)
-        print(yaml.dump_all(docs, sort_keys=False), end="")
+        yaml.dump_all(docs, sys.stdout, sort_keys=False, Dumper=YamlDumper)
 
     def action_edit_resources(self, identifier):
         docs = []
@@ -519,18 +552,18 @@ class QueryDuckCLI(object):
 
     def action_bquery(self, querystr):
         if querystr == "-":
-            q = yaml.load(sys.stdin, Loader=yaml.SafeLoader)
+            q = yaml.load(sys.stdin.buffer.read(), Loader=YamlLoader)
         else:
-            q = yaml.load(querystr, Loader=yaml.SafeLoader)
+            q = yaml.load(querystr, Loader=YamlLoader)
         rp = ResourceProcessor(self)
         docs = rp.query(q, target="blob")
-        print(yaml.dump_all(docs, sort_keys=False), end="")
+        yaml.dump_all(docs, sys.stdout, sort_keys=False, Dumper=YamlDumper)
 
     def action_file_query(self, querystr):
         if querystr == "-":
-            q = yaml.load(sys.stdin, Loader=yaml.SafeLoader)
+            q = yaml.load(sys.stdin.buffer.read(), Loader=YamlLoader)
         else:
-            q = yaml.load(querystr, Loader=yaml.SafeLoader)
+            q = yaml.load(querystr, Loader=YamlLoader)
         sp = StorageProcessor(self)
         paths = sp.file_query(q)
         [print(p) for p in paths]
@@ -545,7 +578,7 @@ class QueryDuckCLI(object):
 
     def action_process_schema_template(self, template_file, output_file):
         with open(template_file, "r") as f:
-            tpl = yaml.load(f, Loader=yaml.SafeLoader)
+            tpl = yaml.load(f, Loader=YamlLoader)
         rp = self.get_rp()
         result = rp.process_schema_template(tpl)
         with open(output_file, "w") as f:
@@ -16,15 +16,14 @@ from .errors import MediaFileError
 
 def call_text_editor(text):
     editor = os.environ.get("EDITOR", "vim")
-    fd, fname = tempfile.mkstemp(suffix=".tmp")
-    with os.fdopen(fd, "w") as f:
+    with tempfile.NamedTemporaryFile("w", suffix=".tmp", delete=False) as f:
         f.write(text)
-        f.close()
+        fname = f.name
 
-    before = os.path.getmtime(fname)
+    before = os.stat(fname).st_mtime_ns
     first = True
     while first or (
-        os.path.getmtime(fname) == before
+        os.stat(fname).st_mtime_ns == before
         and not input("File unchanged, [r]eopen or [c]ontinue? [c] ") != "r"
     ):
         subprocess.call([editor, fname])
@@ -36,6 +35,9 @@ def call_text_editor(text):
 
 
 class FileAnalyzer:
+
+    _magic_cache = {}
+
     def __init__(self, bindings):
         self.bindings = bindings
 
@@ -46,23 +48,30 @@ class FileAnalyzer:
         rsvg_available = os.path.exists("/usr/bin/rsvg-convert")
         return ffprobe_available and convert_available and rsvg_available
 
+    @classmethod
+    def _get_magic(cls, mime, uncompress):
+        key = (mime, uncompress)
+        if key not in cls._magic_cache:
+            cls._magic_cache[key] = magic.Magic(mime=mime, uncompress=uncompress)
+        return cls._magic_cache[key]
+
     def _get_mime_type(self, path, uncompress=False):
-        mime = magic.Magic(mime=True, uncompress=uncompress)
+        mime = self._get_magic(True, uncompress)
         file_type = mime.from_file(str(path))
         return file_type.split("/")[0:2]
 
     def _get_compressed_mime_type(self, path):
-        mime = magic.Magic(mime=True, uncompress=True)
+        mime = self._get_magic(True, True)
         file_type = mime.from_file(str(path))
         return file_type.split("/")[0:2]
 
     def _get_more_type(self, path, uncompress=False):
-        m = magic.Magic(mime=False, uncompress=uncompress)
+        m = self._get_magic(False, uncompress)
         file_type = m.from_file(str(path))
         return file_type
 
     def _get_compressed_more_type(self, path):
-        m = magic.Magic(mime=False, uncompress=True)
+        m = self._get_magic(False, True)
         file_type = m.from_file(str(path))
         return file_type
 